@@ -1,5 +1,6 @@
 import sys
-import copy
+import heapq
+from collections import deque
 from crossword import *
 
 
@@ -15,20 +16,48 @@ class CrosswordCreator():
             for var in self.crossword.variables
         }
 
+        # The crossword graph never changes, so look up neighbors and
+        # overlaps once instead of inside the search loops
+        self._neighbors = {
+            var: tuple(self.crossword.neighbors(var))
+            for var in self.crossword.variables
+        }
+        self._overlap = {
+            (var, neighbor): self.crossword.overlaps[var, neighbor]
+            for var in self._neighbors
+            for neighbor in self._neighbors[var]
+        }
+        self._neighbor_overlaps = {
+            var: tuple(
+                (neighbor, self._overlap[var, neighbor])
+                for neighbor in self._neighbors[var]
+            )
+            for var in self._neighbors
+        }
+
+        # Every directed arc (var, neighbor) of the constraint graph
+        self._arcs = tuple(self._overlap)
+        self._nvars = len(self.domains)
+
+        # Letter indexes of `self.domains`, built by `_build_indexes`
+        self.pos_index = None
+
     def letter_grid(self, assignment):
         """
         Return 2D array representing a given assignment.
         """
         letters = [
-            [None for _ in range(self.crossword.width)]
+            [None] * self.crossword.width
             for _ in range(self.crossword.height)
         ]
         for variable, word in assignment.items():
-            direction = variable.direction
-            for k in range(len(word)):
-                i = variable.i + (k if direction == Variable.DOWN else 0)
-                j = variable.j + (k if direction == Variable.ACROSS else 0)
-                letters[i][j] = word[k]
+            i, j = variable.i, variable.j
+            if variable.direction == Variable.DOWN:
+                for k, letter in enumerate(word):
+                    letters[i + k][j] = letter
+            else:
+                # Across words fill a contiguous slice of a single row
+                letters[i][j:j + len(word)] = word
         return letters
 
     def print(self, assignment):
@@ -37,12 +66,10 @@ class CrosswordCreator():
         """
         letters = self.letter_grid(assignment)
         for i in range(self.crossword.height):
-            for j in range(self.crossword.width):
-                if self.crossword.structure[i][j]:
-                    print(letters[i][j] or " ", end="")
-                else:
-                    print("█", end="")
-            print()
+            print("".join(
+                (letters[i][j] or " ") if self.crossword.structure[i][j] else "█"
+                for j in range(self.crossword.width)
+            ))
 
     def save(self, assignment, filename):
         """
@@ -62,26 +89,31 @@ class CrosswordCreator():
             "black"
         )
         font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", 80)
-        draw = ImageDraw.Draw(img)
 
+        # A rectangle includes both corners, so a white cell is one pixel
+        # wider than its interior
+        blank = Image.new("RGBA", (interior_size + 1, interior_size + 1), "white")
+
+        # Render every distinct letter once onto its own white cell
+        glyphs = dict()
+        for letter in set("".join(assignment.values())):
+            glyph = blank.copy()
+            draw = ImageDraw.Draw(glyph)
+            _, _, w, h = draw.textbbox((0, 0), letter, font=font)
+            draw.text(
+                ((interior_size - w) / 2, (interior_size - h) / 2 - 10),
+                letter, fill="black", font=font
+            )
+            glyphs[letter] = glyph
+
+        # Black cells are left as the canvas background
         for i in range(self.crossword.height):
             for j in range(self.crossword.width):
-
-                rect = [
-                    (j * cell_size + cell_border,
-                     i * cell_size + cell_border),
-                    ((j + 1) * cell_size - cell_border,
-                     (i + 1) * cell_size - cell_border)
-                ]
                 if self.crossword.structure[i][j]:
-                    draw.rectangle(rect, fill="white")
-                    if letters[i][j]:
-                        _, _, w, h = draw.textbbox((0, 0), letters[i][j], font=font)
-                        draw.text(
-                            (rect[0][0] + ((interior_size - w) / 2),
-                             rect[0][1] + ((interior_size - h) / 2) - 10),
-                            letters[i][j], fill="black", font=font
-                        )
+                    img.paste(
+                        glyphs.get(letters[i][j], blank),
+                        (j * cell_size + cell_border, i * cell_size + cell_border)
+                    )
 
         img.save(filename)
 
@@ -99,73 +131,283 @@ class CrosswordCreator():
         (Remove any values that are inconsistent with a variable's unary
          constraints; in this case, the length of the word.)
         """
+        for var in self.domains:
+            # Keep only words that have the same length as the variable
+            self.domains[var] = {
+                word for word in self.domains[var] if len(word) == var.length
+            }
+
+        self._build_indexes()
+
+    def _build_indexes(self):
+        """
+        Build the letter indexes of `self.domains` used by the search:
+        `pos_index`, `letter_mask` and the MRV heap.
+        """
+        self.pos_index = dict()
+        self.letter_mask = dict()
+        self._indexed = dict()
+        self._indexed_size = dict()
+        for var in self.domains:
+            self._index_domain(var)
+        self._rebuild_mrv_heap()
+
+    def _index_domain(self, var):
+        """
+        Index the domain of `var` in `pos_index` and `letter_mask`, and
+        remember which set was indexed and its size.
+        """
+        domain = self.domains[var]
+
+        # For every position, index the words of the domain by the letter
+        # they place there. A word of `x` stays supported by `y` as long as
+        # the bucket of its letter on the shared cell is non-empty. Words
+        # too short to reach a position go in its "" bucket, which supports
+        # nothing.
+        longest = max(map(len, domain), default=0)
+        indexes = [dict() for _ in range(max(longest, var.length))]
+        for word in domain:
+            for k, letter in enumerate(self._padded(word, indexes)):
+                indexes[k].setdefault(letter, set()).add(word)
+        self.pos_index[var] = indexes
+
+        # Bit `ord(letter)` of `letter_mask[var][k]` is set iff some word in
+        # the domain of `var` places `letter` at position `k`
+        self.letter_mask[var] = [
+            sum(1 << ord(letter) for letter in index if letter)
+            for index in indexes
+        ]
 
-        domains = copy.deepcopy(self.domains)
-        for domain in domains:
-            dom = copy.deepcopy(self.domains[domain])
-            for node in dom:
-                # Remove words that do not have the same length as the variable
-                if len(node) != domain.length:
-                    self.domains[domain].remove(node)
+        self._indexed[var] = domain
+        self._indexed_size[var] = len(domain)
 
+    @staticmethod
+    def _padded(word, indexes):
+        """
+        Return the letters of `word` for every position in `indexes`, with
+        "" for the positions it is too short to reach.
+        """
+        if len(word) == len(indexes):
+            return word
+        return tuple(word) + ("",) * (len(indexes) - len(word))
+
+    def _ensure_indexes(self, variables):
+        """
+        Make sure the letter indexes match the domains of `variables`.
+        A domain set that was replaced, or resized other than through the
+        search methods, is indexed again.
+        """
+        if self.pos_index is None:
+            self._build_indexes()
+            return
+
+        for var in variables:
+            domain = self.domains[var]
+            if domain is not self._indexed[var] or len(domain) != self._indexed_size[var]:
+                self._index_domain(var)
+                self._push_mrv(var)
+
+    def _mrv_entry(self, var):
+        """
+        Return the MRV heap entry of `var` for the current size of its domain.
+        """
+        return (len(self.domains[var]), -len(self._neighbors[var]), id(var), var)
+
+    def _rebuild_mrv_heap(self):
+        """
+        Rebuild the MRV heap with one up-to-date entry per variable.
+        """
+        # Candidates for the MRV heuristic, keyed by (domain size, -degree).
+        # Entries go stale when a domain changes size and are skipped lazily;
+        # a fresh entry is pushed on every change.
+        self._mrv_heap = [self._mrv_entry(var) for var in self.domains]
+        heapq.heapify(self._mrv_heap)
+
+    def _push_mrv(self, var):
+        """
+        Push `var` onto the MRV heap with the current size of its domain.
+        Once stale entries make up most of the heap, rebuild it instead.
+        """
+        if len(self._mrv_heap) >= 4 * self._nvars:
+            self._rebuild_mrv_heap()
+        else:
+            heapq.heappush(self._mrv_heap, self._mrv_entry(var))
+
+    def _remove_words(self, var, words, trail=None):
+        """
+        Remove the set `words` from the domain of `var`, keeping `pos_index`
+        and `letter_mask` in sync. Empty letter buckets are dropped from the
+        index. If `trail` is given, record the removal on it so it can be
+        undone.
+        """
+        self.domains[var] -= words
+        indexes = self.pos_index[var]
+        masks = self.letter_mask[var]
+        width = len(indexes)
+        for word in words:
+            letters = word if len(word) == width else self._padded(word, indexes)
+            for k, letter in enumerate(letters):
+                index = indexes[k]
+                bucket = index[letter]
+                bucket.remove(word)
+                if not bucket:
+                    del index[letter]
+                    if letter:
+                        masks[k] &= ~(1 << ord(letter))
+        self._indexed_size[var] = len(self.domains[var])
+        if trail is not None:
+            trail.append((var, words))
+        if words:
+            self._push_mrv(var)
+
+    def _restore(self, trail):
+        """
+        Undo the removals recorded on `trail`, putting every word back into
+        its domain, `pos_index` and `letter_mask`.
+        """
+        for var, words in reversed(trail):
+            self.domains[var] |= words
+            indexes = self.pos_index[var]
+            masks = self.letter_mask[var]
+            width = len(indexes)
+            for word in words:
+                letters = word if len(word) == width else self._padded(word, indexes)
+                for k, letter in enumerate(letters):
+                    index = indexes[k]
+                    if letter not in index:
+                        index[letter] = set()
+                        if letter:
+                            masks[k] |= 1 << ord(letter)
+                    index[letter].add(word)
+            self._indexed_size[var] = len(self.domains[var])
+            self._push_mrv(var)
+        trail.clear()
+
+    def _remove_letters(self, var, k, mask, trail=None):
+        """
+        Remove from the domain of `var` every word whose letter at position
+        `k` has its bit set in `mask`, or that is too short to reach `k`,
+        recording removals on `trail`.
+        """
+        letters = self.pos_index[var][k]
+        words = set(letters.get("", ()))
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            words |= letters[chr(bit.bit_length() - 1)]
+        self._remove_words(var, words, trail)
+
+    def _keep_letter(self, var, k, letter, trail=None):
+        """
+        Remove from the domain of `var` every word that does not place
+        `letter` at position `k`, recording removals on `trail`.
+        """
+        keep = self.pos_index[var][k].get(letter, set())
+        self._remove_words(var, self.domains[var] - keep, trail)
 
-    def revise(self, x, y):
+    def revise(self, x, y, trail=None):
         """
         Make variable `x` arc consistent with variable `y`.
         To do so, remove values from `self.domains[x]` for which there is no
         possible corresponding value for `y` in `self.domains[y]`.
+        Removed values are recorded on `trail` if one is given.
 
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        revision= False
-        overlap  = self.crossword.overlaps[x, y]
+        self._ensure_indexes((x, y))
+        overlap = self._overlap.get((x, y))
 
         # No revision when there is no overlap between the variables
         if overlap is None:
-            return revision
-        
-        domains_x = copy.deepcopy(self.domains[x])
-        domains_y = copy.deepcopy(self.domains[y])
-        
-        for node in domains_x:
-            found = False
-            for node2 in domains_y:
-                if node[overlap[0]] == node2[overlap[1]]:
-                    found = True
-            
-            # Remove word that did not match any other word in the intersection
-            if not found:
-                self.domains[x].remove(node)
-                revision = True
-
-        return revision
+            return False
+
+        # Letters `x` places on the shared cell that no word of `y` supports.
+        # Words of `x` too short to reach the cell are unsupported as well.
+        mask_y = self.letter_mask[y][overlap[1]]
+        unsupported = self.letter_mask[x][overlap[0]] & ~mask_y
+        if not unsupported and "" not in self.pos_index[x][overlap[0]]:
+            return False
+
+        if mask_y and not mask_y & (mask_y - 1):
+            # Every word of `y` places the same letter on the shared cell,
+            # so `x` keeps that letter's bucket and nothing else
+            letter = chr(mask_y.bit_length() - 1)
+            self._keep_letter(x, overlap[0], letter, trail)
+        else:
+            self._remove_letters(x, overlap[0], unsupported, trail)
+        return True
 
 
-    def ac3(self, arcs=None):
+    def ac3(self, arcs=None, trail=None):
         """
         Update `self.domains` such that each variable is arc consistent.
         If `arcs` is None, begin with initial list of all arcs in the problem.
         Otherwise, use `arcs` as the initial list of arcs to make consistent.
+        Removed values are recorded on `trail` if one is given.
 
         Return True if arc consistency is enforced and no domains are empty;
         return False if one or more domains end up empty.
         """
-        if not arcs:
-            # Construct arcs from the variables and their neighbors
-            arcs = [(var, neighbor) for var in self.domains.keys() for neighbor in self.crossword.neighbors(var)]
+        self._ensure_indexes(self.domains)
+        if arcs is None:
+            # Start from every arc between the variables and their neighbors
+            arcs = self._arcs
+
+        queue = deque(arcs)
 
+        # Arcs currently waiting in the queue, so none is enqueued twice
+        in_queue = set(queue)
 
-        while arcs:
-            var1, var2 = arcs.pop(0)  # Remove an arc from the list
+        while queue:
+            arc = queue.popleft()  # Remove an arc from the queue
+            in_queue.discard(arc)
+            var1, var2 = arc
+            masks = list(self.letter_mask[var1])
 
-            if self.revise(var1, var2):
+            if self.revise(var1, var2, trail):
                 if not self.domains[var1]:  # Check if domain is empty
                     return False
 
-                for neighbor in self.crossword.neighbors(var1):
-                    if neighbor != var2:
-                        arcs.append((neighbor, var1))  # Add neighbors to the queue
+                # A neighbor only needs revising again if a letter lost its
+                # last supporting word of `var1` on their shared cell
+                lost = [
+                    before & ~after
+                    for before, after in zip(masks, self.letter_mask[var1])
+                ]
+                for neighbor, overlap in self._neighbor_overlaps[var1]:
+                    if (
+                        neighbor != var2
+                        and lost[overlap[0]]
+                        and (neighbor, var1) not in in_queue
+                    ):
+                        queue.append((neighbor, var1))  # Add neighbors to the queue
+                        in_queue.add((neighbor, var1))
+
+        return True
+
+    def forward_check(self, variable, assignment, trail):
+        """
+        Remove from the domain of every unassigned neighbor of `variable`
+        the words that conflict with the word assigned to `variable`,
+        recording the removals on `trail`.
+
+        Return False if a neighbor's domain ends up empty; return True
+        otherwise.
+        """
+        self._ensure_indexes((variable,) + self._neighbors[variable])
+        value = assignment[variable]
+        for neighbor in self._neighbors[variable]:
+            if neighbor in assignment:
+                continue
+
+            overlap = self._overlap[neighbor, variable]
+            letter = value[overlap[1]]
+            if self.letter_mask[neighbor][overlap[0]] & ~(1 << ord(letter)):
+                self._keep_letter(neighbor, overlap[0], letter, trail)
+
+            if not self.domains[neighbor]:
+                return False
 
         return True
 
@@ -174,9 +416,7 @@ class CrosswordCreator():
         Return True if `assignment` is complete (i.e., assigns a value to each
         crossword variable); return False otherwise.
         """
-        if len(assignment.keys()) == len(self.domains.keys()):
-                return True
-        return False
+        return len(assignment) == self._nvars
 
     def consistent(self, assignment):
         """
@@ -196,14 +436,33 @@ class CrosswordCreator():
                 return False
             
             # Check for conflicts with neighboring variables
-            for neighbor in self.crossword.neighbors(variable):
+            for neighbor in self._neighbors[variable]:
                 if neighbor in assignment:
                     neighbor_value = assignment[neighbor]
-                    overlap = self.crossword.overlaps[variable,neighbor]
+                    overlap = self._overlap[variable, neighbor]
                     if neighbor_value[overlap[1]] != value[overlap[0]]:
                         return False
         return True
-    
+
+    def _consistent_with(self, var, value, assignment, used):
+        """
+        Return True if assigning `value` to `var` keeps the consistent
+        `assignment` consistent; return False otherwise. `used` is the set
+        of words in `assignment`.
+        Only `var` and its assigned neighbors need to be checked, since the
+        rest of `assignment` is already known to be consistent.
+        """
+        # Check if value is distinct and matches the variable's length
+        if value in used or len(value) != var.length:
+            return False
+
+        # Check for conflicts with assigned neighboring variables
+        for neighbor in self._neighbors[var]:
+            if neighbor in assignment:
+                overlap = self._overlap[var, neighbor]
+                if assignment[neighbor][overlap[1]] != value[overlap[0]]:
+                    return False
+        return True
 
     def order_domain_values(self, var, assignment):
         """
@@ -212,23 +471,23 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
-        ordered_values = []
-        
-        # Populate a list with all the values in the variable's domain and the number of values they ruled out
-        for value in self.domains[var]:
-            counter = 0
-            for neighbor in self.crossword.neighbors(var):
-                intersection = self.crossword.overlaps[var,neighbor]
-                for value2 in self.domains[neighbor]:
-                    # Count the number of words in the neighbor variable that conflict with a word of the given variable 
-                    if value[intersection[0]] != value2[intersection[1]] and value2 not in assignment.keys():
-                        counter +=1
-            ordered_values.append((value,counter))
-
-        # Sort list based on the values that got ruled out in ascending order 
-        ordered_values.sort(key=lambda x: x[1])
-
-        return [value for value, _ in ordered_values]
+        self._ensure_indexes((var,) + self._neighbors[var])
+
+        # Sort values based on the neighbor values they rule out in ascending order
+        return sorted(self.domains[var], key=lambda value: self._lcv(var, value))
+
+    def _lcv(self, var, value):
+        """
+        Return the number of values ruled out among the neighbors of `var`
+        by assigning `value` to it.
+        """
+        # Words of a neighbor that conflict with `value` are all those
+        # outside the bucket of the letter `value` places on the shared cell
+        return sum(
+            len(self.domains[neighbor])
+            - len(self.pos_index[neighbor][overlap[1]].get(value[overlap[0]], ()))
+            for neighbor, overlap in self._neighbor_overlaps[var]
+        )
 
    
     def select_unassigned_variable(self, assignment):
@@ -239,15 +498,35 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        unassigned_variables = [var for var in self.domains.keys() if var not in assignment]
-    
-        if not unassigned_variables:
-            return None
-        
-        # Sort unassigned variables based on the minimum number of remaining values
-        unassigned_variables.sort(key=lambda var: (len(self.domains[var]), -len(self.crossword.neighbors(var))))
-        
-        return unassigned_variables[0]
+        self._ensure_indexes(self.domains)
+
+        # Put the entries of assigned variables back, so the heap is left
+        # as it was for later calls
+        assigned = []
+        variable = self._top_unassigned(assignment, assigned)
+        for entry in assigned:
+            heapq.heappush(self._mrv_heap, entry)
+        return variable
+
+    def _top_unassigned(self, assignment, assigned=None):
+        """
+        Return the unassigned variable at the top of the MRV heap, or None.
+        Outdated entries are dropped on the way. Entries of variables in
+        `assignment` are popped too and appended to `assigned` if given.
+        """
+        heap = self._mrv_heap
+        while heap:
+            size, _, _, var = heap[0]
+            if size != len(self.domains[var]):
+                # Outdated entry; a fresh one was pushed when the size changed
+                heapq.heappop(heap)
+            elif var in assignment:
+                entry = heapq.heappop(heap)
+                if assigned is not None:
+                    assigned.append(entry)
+            else:
+                return var
+        return None
 
     def backtrack(self, assignment):
         """
@@ -258,26 +537,51 @@ class CrosswordCreator():
 
         If no assignment is possible, return None.
         """
+        self._ensure_indexes(self.domains)
+
+        try:
+            return self._backtrack(assignment, set(assignment.values()))
+        finally:
+            # The search drops the heap entries of assigned variables
+            self._rebuild_mrv_heap()
+
+    def _backtrack(self, assignment, used):
+        """
+        Recursive step of `backtrack`: extend the consistent `assignment`
+        one variable at a time, keeping the set `used` of its words in sync
+        with it.
+        """
         if self.assignment_complete(assignment):
             return assignment 
         
-        variable = self.select_unassigned_variable(assignment)
+        # Assigned variables stay off the MRV heap until they are unassigned
+        variable = self._top_unassigned(assignment)
 
         if variable is None:
             return assignment
         
         for value in self.order_domain_values(variable, assignment):
+            if not self._consistent_with(variable, value, assignment, used):
+                continue
+
             assignment[variable] = value
-            if self.consistent(assignment):
-                arcs = [(var, variable) for var in self.crossword.neighbors(variable)]
-                inference_result = self.ac3(arcs)
-                if inference_result:
-                    # Recursively call backtrack to construct the solution
-                    result = self.backtrack(assignment)
-                    if result is not None:
-                        return result
-            else:
-                del assignment[variable]
+            used.add(value)
+
+            # Every word pruned while inferring from this value goes on
+            # the trail, so the domains can be put back on failure
+            trail = []
+            self._remove_words(variable, self.domains[variable] - {value}, trail)
+            inference_result = self.forward_check(variable, assignment, trail)
+            if inference_result:
+                # Recursively call backtrack to construct the solution
+                result = self._backtrack(assignment, used)
+                if result is not None:
+                    return result
+            self._restore(trail)
+
+            used.remove(value)
+            del assignment[variable]
+            self._push_mrv(variable)
 
         return None
 